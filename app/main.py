@@ -1,19 +1,22 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-import redis.asyncio as redis
+from fastapi.responses import JSONResponse, ORJSONResponse
 import os
-from typing import Dict
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, Optional
 import google.generativeai as genai
 from pypdf import PdfReader
 from dotenv import load_dotenv
 import logging
 import traceback
 import uuid
+import hashlib
+import aiofiles
 import base64
-from pdf2image import convert_from_bytes
-from utils import get_redis_client
-from io import BytesIO
+import fitz
+from utils import get_redis_client, get_cache_key, CACHE_TTL
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -30,16 +33,48 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
-# Initialize Redis client
-redis_host = os.environ.get("REDIS_HOST", "localhost")
-redis_client = redis.Redis(host=redis_host, port=6379, db=0, decode_responses=True)
-
 # Redis configuration
-REDIS_STREAM = "pdf_tasks"
+REDIS_STREAM_HIGH = "pdf_tasks:high"
+REDIS_STREAM_LOW = "pdf_tasks:low"
 REDIS_GROUP = "pdf_workers"
 
+# Uploads smaller than this (in bytes) go to the high-priority stream
+HIGH_PRIORITY_MAX_SIZE = 1_000_000
+
+# Uploads with more pages than this are rejected before they reach a worker
+MAX_PAGES = int(os.environ.get("MAX_PAGES", 500))
+
+# Uploads larger than this (in bytes) are rejected while they are being streamed
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", 100 * 1024 * 1024))
+
+# Statuses after which a document no longer changes
+TERMINAL_STATUSES = {"completed", "error"}
+
+# Fields returned by /status, with their defaults when unset. "status" must stay first.
+STATUS_FIELDS = {
+    "status": "unknown",
+    "content": "",
+    "summary": "",
+    "error": "",
+    "progress": "",
+    "current_step": "",
+    "total_steps": "0",
+    "current_step_number": "0"
+}
+
+# Longest time /status will hold a long-poll request open, in seconds
+MAX_STATUS_WAIT = 25
+
+# While long-polling, the status is re-read at least this often (in seconds),
+# so clients still see updates if Redis keyspace notifications are disabled
+STATUS_RECHECK_INTERVAL = 5
+
+# Uploads are streamed to disk in chunks of this size
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 # Create uploads directory if it doesn't exist
 UPLOAD_DIR = os.path.join(os.getcwd(), "uploads")
 if not os.path.exists(UPLOAD_DIR):
@@ -52,82 +87,43 @@ if not api_key:
     raise ValueError("GOOGLE_API_KEY environment variable is not set")
 genai.configure(api_key=api_key)
 
-# Initialize Gemini model
-model = genai.GenerativeModel('gemini-2.0-flash')
+# Gemini model used for both page extraction and summaries
+GEMINI_MODEL = 'gemini-2.0-flash'
 
-async def process_with_pypdf(content: bytes) -> dict:
-    """Process PDF content using PyPDF."""
-    try:
-        logger.info("Processing PDF with PyPDF")
-        
-        # Create a BytesIO object from the content
-        pdf_file = BytesIO(content)
-        
-        # Create PDF reader
-        pdf_reader = PdfReader(pdf_file)
-        
-        # Extract text from all pages
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        
-        logger.info(f"Successfully extracted text from PDF (length: {len(text)})")
-        
-        # Generate summary using Gemini
-        prompt = f"""Please analyze the following text and provide a plain text summary (no markdown formatting) with:
-just a single paragraph of a concise summary (2-5 sentences)
+# Resolution used when rasterizing pages for Gemini Vision
+RENDER_DPI = 150
 
-Text:
-{text[:10000]}  # Limit to first 10000 chars to avoid token limits
-"""
-        
-        response = await model.generate_content_async(prompt)
-        summary = response.text
-        
-        # Convert the content to markdown format
-        markdown_content = f"""
+# Longest side of a rendered page in pixels; Gemini Vision downscales anything larger anyway
+MAX_IMAGE_SIDE = 1568
 
-{text}
+# Pages are sent to Gemini as JPEG at this quality, several times smaller than PNG
+JPEG_QUALITY = 85
 
----
-*This content was extracted using PyPDF and formatted in markdown.*"""
-        
-        return {
-            "content": markdown_content,
-            "summary": summary
-        }
-    except Exception as e:
-        logger.error(f"Error in process_with_pypdf: {str(e)}")
-        raise
+# Per-page progress is written to Redis once every this many pages (and for the last page)
+PROGRESS_UPDATE_INTERVAL = 4
 
-async def process_with_gemini(pdf_content: bytes, doc_id: str, redis_client) -> dict:
-    """Process PDF content using Google's Gemini Vision API."""
-    try:
-        # Convert PDF to images
-        images = convert_from_bytes(pdf_content)
-        total_pages = len(images)
-        
-        # Process each page
-        all_text = []
-        for i, image in enumerate(images, 1):
-            # Update progress
-            await redis_client.hset(
-                f"document:{doc_id}",
-                mapping={
-                    "progress": f"Processing page {i}/{total_pages}",
-                    "current_step": "process",
-                    "current_step_number": "3"
-                }
-            )
-            
-            # Convert image to base64
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            
-            # Process with Gemini
-            response = await model.generate_content_async([
-                """Extract and format the text from this image while preserving the exact structure and formatting of the original document. Follow these guidelines:
+# Page rendering and JPEG/base64 encoding run in this process pool, off the event
+# loop and outside the GIL. MuPDF is not thread-safe, so each worker process renders
+# one page at a time, and the pool size caps how many renders run at once.
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", os.cpu_count() or 1))
+
+# Pool processes start lazily, after the worker has opened its gRPC connection to
+# Gemini, and forking a process that is running gRPC threads is unsupported
+POOL_CONTEXT = multiprocessing.get_context("forkserver")
+
+RENDER_POOL = ProcessPoolExecutor(max_workers=RENDER_WORKERS, mp_context=POOL_CONTEXT)
+
+# Maximum number of Gemini page requests in flight per worker process, across all documents
+MAX_CONCURRENT_PAGES = int(os.environ.get("MAX_CONCURRENT_PAGES", 8))
+_page_semaphore = None
+
+# Maximum number of Gemini summary requests in flight per worker process. Kept separate
+# from the page limit so chunk summaries don't queue behind every page still waiting.
+MAX_CONCURRENT_SUMMARIES = int(os.environ.get("MAX_CONCURRENT_SUMMARIES", 2))
+_summary_semaphore = None
+
+# Instructions sent with every page image to Gemini Vision
+PAGE_EXTRACTION_PROMPT = """Extract and format the text from this image while preserving the exact structure and formatting of the original document. Follow these guidelines:
 
 1. Preserve all original formatting:
    - Keep exact text alignment and spacing
@@ -176,17 +172,295 @@ async def process_with_gemini(pdf_content: bytes, doc_id: str, redis_client) ->
      * Do not make them larger than they appear in the original
      * Maintain the same relative size compared to other headings
 
-Output only the formatted text without any additional commentary.""",
-                {
-                    "mime_type": "image/png",
-                    "data": img_str
-                }
-            ])
-            
-            # Clean up the response text
-            text = response.text.strip()
-            if text:
-                all_text.append(text)
+Output only the formatted text without any additional commentary."""
+
+# Vision model with the page instructions as its system instruction, so the
+# static prompt is a fixed prefix and each request only carries the page itself
+page_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=PAGE_EXTRACTION_PROMPT)
+
+# Most text sent in one summary request, to stay within token limits. With the
+# Gemini parser, longer documents are summarized in chunks of this size and the
+# partial summaries combined; the PyPDF parser summarizes only the leading text.
+MAX_SUMMARY_CHARS = 10_000
+
+# Instructions for summarizing extracted text
+SUMMARY_PROMPT = """Please analyze the following text and provide a plain text summary (no markdown formatting) with:
+just a single paragraph of a concise summary (2-5 sentences)"""
+
+# Summary model with the instructions as its system instruction, so each
+# request only carries the document text after the same static prefix
+summary_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=SUMMARY_PROMPT)
+
+# Separates page markdown from its summary when both come from one Gemini call
+SUMMARY_SEPARATOR = "===SUMMARY==="
+
+# Sent with the page of single-page documents so no separate summary call is needed
+INLINE_SUMMARY_PROMPT = f"""After the formatted text, output a line containing only {SUMMARY_SEPARATOR} followed by a plain text summary (no markdown formatting) of the page:
+just a single paragraph of a concise summary (2-5 sentences)"""
+
+# Process pool for CPU-bound PyPDF text extraction (workers start lazily on first use)
+PDF_POOL = ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=POOL_CONTEXT)
+
+# Below this many pages, text is extracted on a thread in one parse
+# instead of paying for the pool hand-off and a re-parse in every worker
+POOL_MIN_PAGES = 20
+
+def _extract_pages(file_path: str, start: int, stop: int) -> list:
+    """Extract text from pages [start, stop) of a PDF file. Runs in PDF_POOL or a thread."""
+    # Given a path, PdfReader reads the whole file into memory; given a file
+    # object, it only seeks to and reads the objects the requested pages need
+    with open(file_path, "rb") as pdf_file:
+        pdf_reader = PdfReader(pdf_file)
+        # Pages without a text layer may yield None, which str.join can't take
+        return [pdf_reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def build_summary_prompt(page_texts: list) -> str:
+    """Build the summary request text from consecutive pages, up to MAX_SUMMARY_CHARS."""
+    # Only join as many pages as the budget needs instead of slicing the whole document
+    selected = []
+    length = 0
+    for page_text in page_texts:
+        if length >= MAX_SUMMARY_CHARS:
+            break
+        selected.append(page_text)
+        length += len(page_text) + 1
+    return "Text:\n" + "\n".join(selected)[:MAX_SUMMARY_CHARS]
+
+class SummaryChunker:
+    """Group consecutive texts, as they arrive, into chunks of at most MAX_SUMMARY_CHARS each."""
+    
+    def __init__(self):
+        self.chunk = []
+        self.chunk_chars = 0
+    
+    def add(self, text: str) -> Optional[list]:
+        """Add the next text, returning the previous chunk if this text doesn't fit in it."""
+        closed = None
+        # A single text longer than the budget gets a chunk of its own (and is truncated)
+        if self.chunk and self.chunk_chars + len(text) > MAX_SUMMARY_CHARS:
+            closed = self.chunk
+            self.chunk = []
+            self.chunk_chars = 0
+        self.chunk.append(text)
+        self.chunk_chars += len(text) + 1
+        return closed
+
+def split_summary_chunks(texts: list) -> list:
+    """Group consecutive texts into chunks of at most MAX_SUMMARY_CHARS each."""
+    chunker = SummaryChunker()
+    chunks = [chunk for chunk in map(chunker.add, texts) if chunk]
+    if chunker.chunk:
+        chunks.append(chunker.chunk)
+    return chunks
+
+async def summarize_chunk(texts: list) -> str:
+    """Summarize texts that fit in a single summary request."""
+    async with get_summary_semaphore():
+        response = await summary_model.generate_content_async(build_summary_prompt(texts))
+    return response.text.strip()
+
+async def summarize_texts(texts: list) -> str:
+    """Summarize texts of any length, map-reducing over chunks when they don't fit in one request."""
+    chunks = split_summary_chunks(texts)
+    if len(chunks) <= 1:
+        return await summarize_chunk(texts)
+    partials = await asyncio.gather(*(summarize_chunk(chunk) for chunk in chunks))
+    return await combine_summaries(partials)
+
+async def combine_summaries(partials: list) -> str:
+    """Reduce partial summaries of consecutive chunks into one summary."""
+    if len(partials) == 1:
+        return partials[0]
+    # Only recurse while the number of summaries shrinks, so this always terminates
+    if len(split_summary_chunks(partials)) < len(partials):
+        return await summarize_texts(partials)
+    return await summarize_chunk(partials)
+
+async def warm_up_gemini():
+    """Open the Gemini connection ahead of the first document so it doesn't pay the handshake."""
+    # count_tokens is free and goes through the same async client as generate_content
+    await page_model.count_tokens_async("ping")
+    logger.info("Gemini connection warmed up")
+
+def count_pdf_pages(file_path: str) -> int:
+    """Count the pages of a PDF, raising if its structure can't be parsed."""
+    # Reads from the open file, so only the page tree is loaded and not the whole document
+    with open(file_path, "rb") as pdf_file:
+        return len(PdfReader(pdf_file, strict=False).pages)
+
+async def process_with_pypdf(file_path: str, page_count: int = 0) -> dict:
+    """Process a PDF file on disk using PyPDF."""
+    try:
+        logger.info("Processing PDF with PyPDF")
+        
+        # The page count is usually known from upload validation; only parse to count it if not
+        if not page_count:
+            page_count = await asyncio.to_thread(count_pdf_pages, file_path)
+        
+        if page_count < POOL_MIN_PAGES:
+            # Small document: a single parse on a thread, which keeps the event loop
+            # free without paying for the pool hand-off
+            parts = await asyncio.to_thread(_extract_pages, file_path, 0, page_count)
+        else:
+            # Extract text in parallel, one contiguous page range per pool worker.
+            # Only the path crosses the process boundary; each worker opens the file itself.
+            step = max(1, -(-page_count // (os.cpu_count() or 1)))
+            loop = asyncio.get_running_loop()
+            futures = [
+                loop.run_in_executor(PDF_POOL, _extract_pages, file_path, start, min(start + step, page_count))
+                for start in range(0, page_count, step)
+            ]
+            parts = [page_text for chunk in await asyncio.gather(*futures) for page_text in chunk]
+        text = "\n".join(parts)
+        
+        logger.info(f"Successfully extracted text from PDF (length: {len(text)})")
+        
+        # Generate summary using Gemini, in a single request over the leading text
+        summary = await summarize_chunk(parts)
+        
+        # Convert the content to markdown format
+        markdown_content = f"""
+
+{text}
+
+---
+*This content was extracted using PyPDF and formatted in markdown.*"""
+        
+        return {
+            "content": markdown_content,
+            "summary": summary
+        }
+    except Exception as e:
+        logger.error(f"Error in process_with_pypdf: {str(e)}")
+        raise
+
+def get_page_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore bounding concurrent Gemini page requests in this process."""
+    # Created lazily so it belongs to the running event loop
+    global _page_semaphore
+    if _page_semaphore is None:
+        _page_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PAGES)
+    return _page_semaphore
+
+def get_summary_semaphore() -> asyncio.Semaphore:
+    """Get the semaphore bounding concurrent Gemini summary requests in this process."""
+    # Created lazily so it belongs to the running event loop
+    global _summary_semaphore
+    if _summary_semaphore is None:
+        _summary_semaphore = asyncio.Semaphore(MAX_CONCURRENT_SUMMARIES)
+    return _summary_semaphore
+
+def _render_page(file_path: str, page_number: int) -> str:
+    """Render a page to JPEG and return it base64-encoded. Runs in RENDER_POOL."""
+    # Opened per render rather than cached in the pool worker: the upload is deleted
+    # once its document is done, and a cached handle would keep it (and its MuPDF
+    # memory) alive in every pool process
+    with fitz.open(file_path) as pdf_document:
+        page = pdf_document[page_number]
+        
+        # Render at RENDER_DPI, scaled down so the longest side stays within MAX_IMAGE_SIDE.
+        # Rendering smaller directly is cheaper than rendering large and resizing.
+        zoom = RENDER_DPI / 72
+        longest_side = max(page.rect.width, page.rect.height)
+        if longest_side * zoom > MAX_IMAGE_SIDE:
+            zoom = MAX_IMAGE_SIDE / longest_side
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    jpeg_bytes = pixmap.tobytes("jpeg", jpg_quality=JPEG_QUALITY)
+    return base64.b64encode(jpeg_bytes).decode()
+
+async def extract_page_with_gemini(file_path: str, page_number: int, semaphore: asyncio.Semaphore,
+                                   with_summary: bool = False) -> tuple:
+    """Render a single page and extract its text (and optionally a summary) with Gemini Vision."""
+    async with semaphore:
+        # Render page to JPEG and convert to base64
+        loop = asyncio.get_running_loop()
+        img_str = await loop.run_in_executor(RENDER_POOL, _render_page, file_path, page_number)
+        
+        # Process with Gemini
+        contents = [
+            {
+                "mime_type": "image/jpeg",
+                "data": img_str
+            }
+        ]
+        if with_summary:
+            contents.append(INLINE_SUMMARY_PROMPT)
+        response = await page_model.generate_content_async(contents)
+    
+    # Clean up the response text
+    return page_number, response.text.strip()
+
+async def process_with_gemini(file_path: str, doc_id: str, redis_client, page_count: int = 0) -> dict:
+    """Process a PDF file on disk using Google's Gemini Vision API."""
+    try:
+        # The page count is usually known from upload validation; pages are
+        # rasterized in RENDER_POOL as they are needed
+        if page_count:
+            total_pages = page_count
+        else:
+            with fitz.open(file_path) as pdf_document:
+                total_pages = pdf_document.page_count
+        
+        # Single-page documents get their summary from the same Gemini call
+        summarize_inline = total_pages == 1
+        
+        # Send all pages to Gemini concurrently, bounded to respect rate limits
+        semaphore = get_page_semaphore()
+        tasks = [
+            asyncio.ensure_future(
+                extract_page_with_gemini(file_path, page_number, semaphore, summarize_inline)
+            )
+            for page_number in range(total_pages)
+        ]
+        
+        # Collect results as they complete, keeping them in page order (None = not done yet)
+        page_texts = [None] * total_pages
+        
+        # Consecutive pages are summarized in MAX_SUMMARY_CHARS chunks as soon as each
+        # chunk is complete, overlapping with the pages still being extracted
+        summary_tasks = []
+        chunker = SummaryChunker()
+        leading_pages = 0
+        try:
+            for completed, task in enumerate(asyncio.as_completed(tasks), 1):
+                page_number, text = await task
+                page_texts[page_number] = text
+                
+                if not summarize_inline:
+                    while leading_pages < total_pages and page_texts[leading_pages] is not None:
+                        page_text = page_texts[leading_pages]
+                        leading_pages += 1
+                        if not page_text:
+                            continue
+                        chunk = chunker.add(page_text)
+                        if chunk:
+                            summary_tasks.append(asyncio.ensure_future(summarize_chunk(chunk)))
+                
+                # Update progress, batched so long documents don't cost one round-trip per page
+                if completed % PROGRESS_UPDATE_INTERVAL == 0 or completed == total_pages:
+                    await redis_client.hset(
+                        f"document:{doc_id}",
+                        mapping={
+                            "progress": f"Processed page {completed}/{total_pages}",
+                            "current_step": "process",
+                            "current_step_number": "3"
+                        }
+                    )
+        except BaseException:
+            # Don't keep paying for the remaining pages once one has failed
+            for task in tasks:
+                task.cancel()
+            for summary_task in summary_tasks:
+                summary_task.cancel()
+            raise
+        
+        summary = ""
+        if summarize_inline:
+            page_text, _, summary = page_texts[0].partition(SUMMARY_SEPARATOR)
+            page_texts[0] = page_text.strip()
+            summary = summary.strip()
+        
+        all_text = [text for text in page_texts if text]
         
         # Combine all text and format as markdown
         content = "\n\n".join(all_text)
@@ -199,25 +473,29 @@ Output only the formatted text without any additional commentary.""",
 ---
 *This content was extracted using Google's Gemini Vision API and formatted in markdown.*"""
         
-        # Generate summary
-        await redis_client.hset(
-            f"document:{doc_id}",
-            mapping={
-                "progress": "Generating summary...",
-                "current_step": "summary",
-                "current_step_number": "4"
-            }
-        )
-        
-        summary_prompt = f"""Please analyze the following text and provide a plain text summary (no markdown formatting) with:
-just a single paragraph of a concise summary (2-5 sentences)
-
-Text:
-{content[:10000]}  # Limit to first 10000 chars to avoid token limits
-"""
-        
-        summary_response = await model.generate_content_async(summary_prompt)
-        summary = summary_response.text
+        # Generate summary, unless it already came back with the page
+        if not summary:
+            await redis_client.hset(
+                f"document:{doc_id}",
+                mapping={
+                    "progress": "Generating summary...",
+                    "current_step": "summary",
+                    "current_step_number": "4"
+                }
+            )
+            
+            if not summary_tasks:
+                summary = await summarize_chunk(all_text)
+            else:
+                # Summarize the last chunk, then combine it with the chunks already done
+                summary_tasks.append(asyncio.ensure_future(summarize_chunk(chunker.chunk)))
+                try:
+                    partials = await asyncio.gather(*summary_tasks)
+                except BaseException:
+                    for summary_task in summary_tasks:
+                        summary_task.cancel()
+                    raise
+                summary = await combine_summaries(partials)
         
         return {
             "content": markdown_content,
@@ -230,73 +508,189 @@ Text:
 @app.post("/upload")
 async def upload_file(file: UploadFile = File(...), parser: str = Form("pypdf")):
     """Upload a PDF file and process it."""
+    file_path = None
     try:
         if not file.filename.endswith('.pdf'):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed")
         
         logger.info(f"Received upload request with parser: {parser}")
         
-        # Read file content
-        content = await file.read()
-        
-        # Validate PDF header
-        if not content.startswith(b'%PDF-'):
+        # Sniff only the PDF header, so junk uploads are rejected before reading the rest
+        chunk = await file.read(5)
+        if chunk != b'%PDF-':
             raise HTTPException(status_code=400, detail="Invalid PDF file: File does not start with PDF header")
         
         # Generate a unique ID for the document
         doc_id = str(uuid.uuid4())
         
-        # Encode content as base64
-        content_b64 = base64.b64encode(content).decode('utf-8')
+        # Stream the upload to disk instead of holding it in memory,
+        # hashing it on the way for the results cache
+        file_path = os.path.join(UPLOAD_DIR, f"{doc_id}.pdf")
+        hasher = hashlib.blake2b(digest_size=16)
+        file_size = 0
+        async with aiofiles.open(file_path, "wb") as buffer:
+            while chunk:
+                hasher.update(chunk)
+                file_size += len(chunk)
+                if file_size > MAX_UPLOAD_SIZE:
+                    break
+                await buffer.write(chunk)
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if file_size > MAX_UPLOAD_SIZE:
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail=f"PDF is larger than the maximum of {MAX_UPLOAD_SIZE} bytes")
+        content_hash = hasher.hexdigest()
         
         # Get Redis client
         redis_client = await get_redis_client(decode_responses=True)
         
-        # Create task data
+        # Serve identical PDFs from the cache instead of processing them again
+        cache_key = get_cache_key(content_hash, parser)
+        cached = await redis_client.hgetall(cache_key)
+        if cached:
+            logger.info(f"Cache hit for document {doc_id} with parser: {parser}")
+            # Also extend the entry's lifetime, so frequently uploaded PDFs stay cached
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.hset(f"document:{doc_id}", mapping={
+                    "status": "completed",
+                    "content": cached["content"],
+                    "summary": cached["summary"],
+                    "progress": "Processing completed successfully",
+                    "current_step": "complete",
+                    "total_steps": "5",
+                    "current_step_number": "5"
+                })
+                pipe.expire(cache_key, CACHE_TTL)
+                await pipe.execute()
+            os.remove(file_path)
+            return {"message": "File uploaded successfully", "doc_id": doc_id}
+        
+        # Cheap structural check, so corrupt or oversized PDFs fail here in
+        # milliseconds instead of occupying a worker and Gemini budget
+        try:
+            page_count = await asyncio.to_thread(count_pdf_pages, file_path)
+        except Exception as e:
+            os.remove(file_path)
+            logger.error(f"Rejected corrupt PDF upload: {str(e)}")
+            raise HTTPException(status_code=400, detail="Invalid PDF file: Could not read document structure")
+        if page_count > MAX_PAGES:
+            os.remove(file_path)
+            raise HTTPException(status_code=413, detail=f"PDF has {page_count} pages, the maximum is {MAX_PAGES}")
+        
+        # Create task data (only a reference to the file, not its content)
         task_data = {
             "doc_id": doc_id,
-            "content": content_b64,
-            "parser": parser
+            "path": file_path,
+            "parser": parser,
+            "content_hash": content_hash,
+            "priority": "high" if file_size < HIGH_PRIORITY_MAX_SIZE else "low",
+            "page_count": page_count
         }
         
-        # Send task to Redis stream
-        logger.info(f"Sending task to Redis with parser: {parser}")
-        await redis_client.xadd(REDIS_STREAM, task_data)
+        # Small PDFs get their own stream so they don't queue behind large ones
+        stream_name = REDIS_STREAM_HIGH if task_data["priority"] == "high" else REDIS_STREAM_LOW
         
-        # Set initial status
-        await redis_client.hset(f"document:{doc_id}", mapping={
-            "status": "queued",
-            "progress": "Task queued for processing",
-            "current_step": "init",
-            "total_steps": "5",
-            "current_step_number": "0"
-        })
+        # Set initial status and send task to Redis stream in one round-trip.
+        # The status is written first so the worker can never have its
+        # "processing" update overwritten by "queued".
+        logger.info(f"Sending task to Redis with parser: {parser}")
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(f"document:{doc_id}", mapping={
+                "status": "queued",
+                "progress": "Task queued for processing",
+                "current_step": "init",
+                "total_steps": "5",
+                "current_step_number": "0",
+                "page_count": page_count
+            })
+            pipe.xadd(stream_name, task_data)
+            await pipe.execute()
         
         return {"message": "File uploaded successfully", "doc_id": doc_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error uploading file: {str(e)}")
+        # No task was queued for the file, so nothing else will remove it
+        if file_path is not None and os.path.exists(file_path):
+            os.remove(file_path)
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/status/{document_id}")
-async def get_status(document_id: str):
+async def read_status(redis_client, document_id: str) -> Optional[dict]:
+    """Read the status of a document, or None if it does not exist."""
+    # HMGET only the fields the API returns rather than HGETALL on the whole hash
+    values = await redis_client.hmget(f"document:{document_id}", *STATUS_FIELDS)
+    
+    # Every document hash is created with a status field
+    if values[0] is None:
+        return None
+    
+    return {
+        field: default if value is None else value
+        for (field, default), value in zip(STATUS_FIELDS.items(), values)
+    }
+
+def status_etag(status: dict) -> str:
+    """Build an ETag that changes whenever the visible status of a document changes."""
+    fingerprint = "|".join((status["status"], status["progress"], status["current_step"], status["current_step_number"]))
+    return f'"{hashlib.sha1(fingerprint.encode()).hexdigest()}"'
+
+async def wait_for_status_change(redis_client, document_id: str, etag: str, timeout: float) -> Optional[dict]:
+    """Wait until the status of a document no longer matches etag, or until timeout."""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    
+    # Woken up by keyspace notifications on the document hash (notify-keyspace-events Kh)
+    pubsub = redis_client.pubsub()
+    await pubsub.subscribe(f"__keyspace@0__:document:{document_id}")
+    try:
+        # Re-read after subscribing so a change made in between is not missed
+        status = await read_status(redis_client, document_id)
+        while status is not None and status_etag(status) == etag:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            await pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=min(remaining, STATUS_RECHECK_INTERVAL)
+            )
+            status = await read_status(redis_client, document_id)
+        return status
+    finally:
+        await pubsub.aclose()
+
+@app.get("/status/{document_id}", response_class=ORJSONResponse)
+async def get_status(document_id: str, request: Request, wait: int = 0):
     """Get the status of a document processing task."""
     try:
         redis_client = await get_redis_client(decode_responses=True)
-        task_data = await redis_client.hgetall(f"document:{document_id}")
+        status = await read_status(redis_client, document_id)
         
-        if not task_data:
+        if status is None:
             raise HTTPException(status_code=404, detail="Document not found")
-            
-        return {
-            "status": task_data.get("status", "unknown"),
-            "content": task_data.get("content", ""),
-            "summary": task_data.get("summary", ""),
-            "error": task_data.get("error", ""),
-            "progress": task_data.get("progress", ""),
-            "current_step": task_data.get("current_step", ""),
-            "total_steps": task_data.get("total_steps", "0"),
-            "current_step_number": task_data.get("current_step_number", "0")
-        }
+        
+        # Long-poll: when the client already has the current status and asked to
+        # wait, hold the request until the status changes (304 if it never does)
+        if_none_match = request.headers.get("if-none-match")
+        etag = status_etag(status)
+        if wait > 0 and if_none_match == etag and status["status"] not in TERMINAL_STATUSES:
+            status = await wait_for_status_change(
+                redis_client, document_id, etag, min(wait, MAX_STATUS_WAIT)
+            )
+            if status is None:
+                raise HTTPException(status_code=404, detail="Document not found")
+            etag = status_etag(status)
+        
+        # Finished documents never change again, so clients can stop re-fetching them
+        if status["status"] in TERMINAL_STATUSES:
+            cache_control = "private, max-age=3600"
+        else:
+            cache_control = "no-cache"
+        headers = {"Cache-Control": cache_control, "ETag": etag}
+        
+        if if_none_match == etag:
+            return Response(status_code=304, headers=headers)
+        return ORJSONResponse(status, headers=headers)
     except HTTPException:
         raise
     except Exception as e:
@@ -305,11 +699,17 @@ async def get_status(document_id: str):
 
 if __name__ == "__main__":
     import uvicorn
+    # Auto-reload is for development only and can't be combined with multiple workers
+    reload = os.getenv("UVICORN_RELOAD") == "1"
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,
-        reload_dirs=["app"],
+        workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2)),
+        loop="uvloop",
+        http="httptools",
+        reload=reload,
+        # Only passed with reload, since uvicorn warns about it otherwise
+        **({"reload_dirs": ["app"]} if reload else {}),
         log_level="info"
     ) 
\ No newline at end of file
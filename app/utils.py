@@ -9,10 +9,24 @@ load_dotenv()
 REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
 
+# Processing results are cached by PDF content hash for this many seconds
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 86400))
+
+# Connection pools shared by every client in the process, keyed by decode_responses
+_connection_pools = {}
+
 async def get_redis_client(decode_responses=True):
-    """Get a Redis client with the specified configuration."""
-    return redis.Redis(
-        host=REDIS_HOST,
-        port=REDIS_PORT,
-        decode_responses=decode_responses
-    ) 
\ No newline at end of file
+    """Get a Redis client with the specified configuration, backed by a shared connection pool."""
+    pool = _connection_pools.get(decode_responses)
+    if pool is None:
+        pool = redis.ConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            decode_responses=decode_responses
+        )
+        _connection_pools[decode_responses] = pool
+    return redis.Redis(connection_pool=pool)
+
+def get_cache_key(content_hash: str, parser: str) -> str:
+    """Get the Redis key holding cached results for a PDF content hash and parser."""
+    return f"cache:{content_hash}:{parser}"
\ No newline at end of file
@@ -1,157 +1,115 @@
 import redis.asyncio as redis
 import os
+import socket
 import json
 from dotenv import load_dotenv
 import asyncio
+import uvloop
 import logging
 import traceback
-import base64
-from utils import get_redis_client, REDIS_HOST, REDIS_PORT
+from utils import get_redis_client, get_cache_key, CACHE_TTL, REDIS_HOST, REDIS_PORT
+from main import process_with_gemini, process_with_pypdf, warm_up_gemini
 
-# Set up logging
+# Set up logging (force replaces the basic handler main.py installs on import)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    force=True
 )
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 # Redis stream configuration
-REDIS_STREAM = "pdf_tasks"
+REDIS_STREAM_HIGH = "pdf_tasks:high"
+REDIS_STREAM_LOW = "pdf_tasks:low"
 REDIS_GROUP = "pdf_workers"
-REDIS_CONSUMER = "worker-1"
+# Prefix for this worker's consumer names. The hostname tells worker containers apart
+# and stays the same across restarts, so a restarted worker reuses its consumers
+# instead of leaving abandoned ones (and their pending messages) in the group.
+REDIS_CONSUMER = f"worker-{socket.gethostname()}"
 
-async def process_document(doc_id: str, content: str, parser: str):
-    """Process a document using the specified parser."""
-    redis_client = await get_redis_client(decode_responses=True)
+# Independent consumers per worker process. Gemini concurrency stays bounded
+# by main.MAX_CONCURRENT_PAGES however many there are.
+CONSUMER_COUNT = int(os.environ.get("WORKER_CONSUMERS", 4))
+
+# Most messages each consumer processes at once. Kept small so a worker process
+# doesn't claim messages that other worker processes could start on sooner.
+BATCH_SIZE = int(os.environ.get("WORKER_BATCH_SIZE", 4))
+
+def cache_result(pipe, content_hash: str, parser: str, result: dict):
+    """Queue caching of processing results so identical uploads can skip the worker."""
+    if not content_hash:
+        return
+    cache_key = get_cache_key(content_hash, parser)
+    pipe.hset(cache_key, mapping={
+        "content": result["content"],
+        "summary": result["summary"]
+    })
+    pipe.expire(cache_key, CACHE_TTL)
+
+async def process_document(doc_id: str, file_path: str, parser: str, redis_client,
+                           content_hash: str = "", page_count: int = 0):
+    """Process a document using the specified parser, recording any failure in its status."""
     try:
         logger.info(f"Starting to process document {doc_id} with parser {parser}")
         
-        # Update status to processing
+        # Pick the parser first, so the status can go straight to its step
+        if parser == "gemini":
+            logger.info("Using Gemini parser")
+            step = {
+                "progress": "Converting PDF to images...",
+                "current_step": "convert",
+                "current_step_number": "2"
+            }
+        elif parser == "pypdf":
+            logger.info("Using PyPDF parser")
+            step = {
+                "progress": "Processing with PyPDF...",
+                "current_step": "process",
+                "current_step_number": "2"
+            }
+        else:
+            raise ValueError(f"Unsupported parser: {parser}")
+        
+        # Update status to processing, entering the parser step in the same write
         await redis_client.hset(
             f"document:{doc_id}",
             mapping={
                 "status": "processing",
-                "progress": "Starting PDF processing...",
-                "current_step": "init",
                 "total_steps": "5",
-                "current_step_number": "0"
+                **step
             }
         )
         
-        # Decode base64 content
-        try:
-            await redis_client.hset(
-                f"document:{doc_id}",
-                mapping={
-                    "progress": "Decoding PDF content...",
-                    "current_step": "decode",
-                    "current_step_number": "1"
-                }
-            )
-            content_bytes = base64.b64decode(content)
-        except Exception as e:
-            logger.error(f"Error decoding base64 content: {str(e)}")
-            await redis_client.hset(
+        # Process with selected parser
+        if parser == "gemini":
+            result = await process_with_gemini(file_path, doc_id, redis_client, page_count)
+        else:
+            result = await process_with_pypdf(file_path, page_count)
+        
+        # Update Redis with results and fill the cache in one round-trip
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.hset(
                 f"document:{doc_id}",
                 mapping={
-                    "status": "error",
-                    "error": "Invalid content format in Redis",
-                    "progress": "Failed to decode PDF content"
+                    "status": "completed",
+                    "content": result["content"],
+                    "summary": result["summary"],
+                    "progress": "Processing completed successfully",
+                    "current_step": "complete",
+                    "current_step_number": "5"
                 }
             )
-            raise ValueError("Invalid content format in Redis")
-        
-        # Process with selected parser
-        if parser == "gemini":
-            logger.info("Using Gemini parser")
-            try:
-                # Convert PDF to images
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "progress": "Converting PDF to images...",
-                        "current_step": "convert",
-                        "current_step_number": "2"
-                    }
-                )
-                
-                from main import process_with_gemini
-                result = await process_with_gemini(content_bytes, doc_id, redis_client)
-                
-                # Update Redis with results
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "status": "completed",
-                        "content": result["content"],
-                        "summary": result["summary"],
-                        "progress": "Processing completed successfully",
-                        "current_step": "complete",
-                        "current_step_number": "5"
-                    }
-                )
-                logger.info(f"Successfully processed document {doc_id}")
-            except ValueError as ve:
-                # Handle validation errors
-                logger.error(f"Validation error for document {doc_id}: {str(ve)}")
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "status": "error",
-                        "error": str(ve),
-                        "progress": f"Error: {str(ve)}"
-                    }
-                )
-                raise
-        elif parser == "pypdf":
-            logger.info("Using PyPDF parser")
-            try:
-                # Process with PyPDF
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "progress": "Processing with PyPDF...",
-                        "current_step": "process",
-                        "current_step_number": "2"
-                    }
-                )
-                
-                from main import process_with_pypdf
-                result = await process_with_pypdf(content_bytes)
-                
-                # Update Redis with results
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "status": "completed",
-                        "content": result["content"],
-                        "summary": result["summary"],
-                        "progress": "Processing completed successfully",
-                        "current_step": "complete",
-                        "current_step_number": "5"
-                    }
-                )
-                logger.info(f"Successfully processed document {doc_id}")
-            except Exception as e:
-                logger.error(f"Error processing with PyPDF: {str(e)}")
-                await redis_client.hset(
-                    f"document:{doc_id}",
-                    mapping={
-                        "status": "error",
-                        "error": str(e),
-                        "progress": f"Error: {str(e)}"
-                    }
-                )
-                raise
-        else:
-            raise ValueError(f"Unsupported parser: {parser}")
+            cache_result(pipe, content_hash, parser, result)
+            await pipe.execute()
+        logger.info(f"Successfully processed document {doc_id}")
             
     except Exception as e:
         logger.error(f"Error processing document {doc_id}: {str(e)}")
         logger.error(f"Traceback: {e.__traceback__}")
-        # Update Redis with error status
+        # Update Redis with error status. Once it is written the document is finished,
+        # so the message is acknowledged like a successful one; only raise if this fails.
         await redis_client.hset(
             f"document:{doc_id}",
             mapping={
@@ -160,76 +118,130 @@ async def process_document(doc_id: str, content: str, parser: str):
                 "progress": f"Error: {str(e)}"
             }
         )
-        raise
+    finally:
+        # The upload is only needed while processing; nothing re-reads a finished message
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+async def handle_message(stream: str, message_id: str, message_data: dict, redis_client) -> bool:
+    """Process a single stream message, returning whether it can be acknowledged."""
+    try:
+        doc_id = message_data["doc_id"]
+        file_path = message_data["path"]
+        parser = message_data["parser"]
+        content_hash = message_data.get("content_hash", "")
+        page_count = int(message_data.get("page_count", 0))
+        
+        logger.info(f"Received new message {message_id} from {stream}")
+        logger.info(f"Processing message for document: {doc_id}")
+        
+        # Process the document
+        await process_document(doc_id, file_path, parser, redis_client, content_hash, page_count)
+        return True
+    except Exception as e:
+        logger.error(f"Error processing message {message_id}: {str(e)}")
+        logger.error(f"Traceback: {e.__traceback__}")
+        # The document's status couldn't be recorded, so leave the message pending
+        return False
+
+async def consume_loop(redis_client, consumer: str):
+    """Read messages as one consumer of the group and process each as soon as it arrives."""
+    # Messages being processed, by task; new ones are only read into free slots
+    in_flight = {}
+    # Successful messages waiting to be acknowledged, by stream
+    to_ack = {}
+    while True:
+        try:
+            if len(in_flight) >= BATCH_SIZE:
+                await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            for task in [task for task in in_flight if task.done()]:
+                stream, message_id = in_flight.pop(task)
+                if task.result():
+                    to_ack.setdefault(stream, []).append(message_id)
+            
+            # Acknowledge everything that finished since the last pass with one XACK per stream
+            if to_ack:
+                async with redis_client.pipeline(transaction=False) as pipe:
+                    for stream, message_ids in to_ack.items():
+                        pipe.xack(stream, REDIS_GROUP, *message_ids)
+                    await pipe.execute()
+                logger.info(f"Acknowledged {sum(len(ids) for ids in to_ack.values())} messages")
+                to_ack.clear()
+            
+            if len(in_flight) >= BATCH_SIZE:
+                continue
+            free_slots = BATCH_SIZE - len(in_flight)
+            
+            # Small PDFs first: take from the high-priority stream without blocking,
+            # and only block on both streams when it is empty
+            response = await redis_client.xreadgroup(
+                REDIS_GROUP,
+                consumer,
+                {REDIS_STREAM_HIGH: ">"},
+                count=free_slots
+            )
+            if not response:
+                # COUNT applies to each stream separately, so split the free slots
+                # between them (overshooting by at most one when only one is free)
+                response = await redis_client.xreadgroup(
+                    REDIS_GROUP,
+                    consumer,
+                    {REDIS_STREAM_HIGH: ">", REDIS_STREAM_LOW: ">"},
+                    count=max(1, free_slots // 2),
+                    block=5000
+                )
+            
+            if not response:
+                logger.info("No messages received, continuing...")
+                continue
+            
+            # Start each message right away instead of waiting for a whole batch to finish
+            for stream, messages in response:
+                for message_id, message_data in messages:
+                    task = asyncio.ensure_future(
+                        handle_message(stream, message_id, message_data, redis_client)
+                    )
+                    in_flight[task] = (stream, message_id)
+                
+        except Exception as e:
+            logger.error(f"Error in consumer {consumer}: {str(e)}")
+            logger.error(f"Traceback: {e.__traceback__}")
+            continue
 
 async def main():
     """Main worker loop."""
     try:
-        # Connect to Redis
+        # Connect to Redis; this one client (and its connection pool) serves every document
         redis_client = await get_redis_client(decode_responses=True)
         await redis_client.ping()
         logger.info("Successfully connected to Redis")
         
-        # Create consumer group if it doesn't exist
+        # Establish the Gemini connection before the first document arrives
         try:
-            await redis_client.xgroup_create(REDIS_STREAM, REDIS_GROUP, mkstream=True)
-            logger.info("Created Redis stream group")
-        except redis.ResponseError as e:
-            if "BUSYGROUP" in str(e):
-                logger.info("Redis stream group already exists")
-            else:
-                raise
-        
-        logger.info("Waiting for new messages in Redis stream...")
+            await warm_up_gemini()
+        except Exception as e:
+            logger.warning(f"Gemini warm-up failed, continuing without it: {str(e)}")
         
-        while True:
+        # Create consumer groups if they don't exist
+        for stream_name in (REDIS_STREAM_HIGH, REDIS_STREAM_LOW):
             try:
-                # Read from stream with blocking
-                response = await redis_client.xreadgroup(
-                    REDIS_GROUP,
-                    REDIS_CONSUMER,
-                    {REDIS_STREAM: ">"},
-                    count=1,
-                    block=5000
-                )
-                
-                if not response:
-                    logger.info("No messages received, continuing...")
-                    continue
-                    
-                # Process the message
-                stream, messages = response[0]
-                for message_id, message_data in messages:
-                    try:
-                        doc_id = message_data["doc_id"]
-                        content = message_data["content"]
-                        parser = message_data["parser"]
-                        
-                        logger.info(f"Received new message {message_id}")
-                        logger.info(f"Processing message for document: {doc_id}")
-                        
-                        # Process the document
-                        await process_document(doc_id, content, parser)
-                        
-                        # Acknowledge the message
-                        await redis_client.xack(REDIS_STREAM, REDIS_GROUP, message_id)
-                        logger.info(f"Acknowledged message {message_id}")
-                        
-                    except Exception as e:
-                        logger.error(f"Error processing message {message_id}: {str(e)}")
-                        logger.error(f"Traceback: {e.__traceback__}")
-                        # Don't acknowledge the message so it can be retried
-                        continue
-                    
-            except Exception as e:
-                logger.error(f"Error in main loop: {str(e)}")
-                logger.error(f"Traceback: {e.__traceback__}")
-                continue
-                
+                await redis_client.xgroup_create(stream_name, REDIS_GROUP, mkstream=True)
+                logger.info(f"Created Redis stream group for {stream_name}")
+            except redis.ResponseError as e:
+                if "BUSYGROUP" in str(e):
+                    logger.info(f"Redis stream group for {stream_name} already exists")
+                else:
+                    raise
+        
+        consumers = [f"{REDIS_CONSUMER}-{i}" for i in range(CONSUMER_COUNT)]
+        logger.info(f"Waiting for new messages in Redis stream with {len(consumers)} consumers...")
+        await asyncio.gather(*(consume_loop(redis_client, consumer) for consumer in consumers))
+    
     except Exception as e:
         logger.error(f"Fatal error: {str(e)}")
         logger.error(traceback.format_exc())
         raise
 
 if __name__ == "__main__":
+    uvloop.install()
     asyncio.run(main()) 
\ No newline at end of file
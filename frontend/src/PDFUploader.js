@@ -69,18 +69,27 @@ const PDFUploader = () => {
 
       setProgress('Processing document...');
 
-      // Poll for status updates
-      const pollInterval = setInterval(async () => {
+      // Long-poll for status updates: the server holds each request until the status changes
+      let etag = null;
+      let polling = true;
+      while (polling) {
         try {
-          const statusResponse = await fetch(`http://localhost:8000/status/${data.doc_id}`);
+          const statusResponse = await fetch(`http://localhost:8000/status/${data.doc_id}?wait=25`, {
+            headers: etag ? { 'If-None-Match': etag } : {},
+            cache: 'no-store',
+          });
+          if (statusResponse.status === 304) {
+            continue;
+          }
           if (!statusResponse.ok) {
             throw new Error('Failed to get status');
           }
           
+          etag = statusResponse.headers.get('ETag');
           const statusData = await statusResponse.json();
 
           if (statusData.status === 'completed') {
-            clearInterval(pollInterval);
+            polling = false;
             setProcessing(false);
             setProgress('');
             setDocuments(prev => [{
@@ -89,7 +98,7 @@ const PDFUploader = () => {
               ...statusData
             }, ...prev]);
           } else if (statusData.status === 'error') {
-            clearInterval(pollInterval);
+            polling = false;
             setProcessing(false);
             setError(statusData.error || 'Processing failed');
             setProgress('');
@@ -97,12 +106,12 @@ const PDFUploader = () => {
             setProgress(statusData.progress || 'Processing...');
           }
         } catch (error) {
-          clearInterval(pollInterval);
+          polling = false;
           setProcessing(false);
           setError('Failed to get status updates');
           setProgress('');
         }
-      }, 1000);
+      }
     } catch (error) {
       setProcessing(false);
       setError(error.message);